@@ -37,6 +37,7 @@ def main():
     logger.info(f"Fetching posts processed since {since.isoformat()} UTC")
 
     posts = state_store.get_posts_since(since)
+    state_store.close()
     logger.info(f"Found {len(posts)} new posts to summarise")
 
     if not posts:
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Google Credentials
+Loads the Google service account once per process and shares it between
+the Google Sheets and Google Drive integrations
+"""
+
+import os
+import threading
+from typing import List, Dict, Tuple, Optional
+
+import json_codec
+
+# Parsed credentials keyed by (source, scopes)
+_creds_cache: Dict[Tuple, object] = {}
+_creds_lock = threading.Lock()
+
+
+def get_credentials(
+    scopes: List[str],
+    credentials_json=None,
+    credentials_file: Optional[str] = None
+):
+    """
+    Get service account credentials for the given scopes
+    
+    A key file (GOOGLE_CREDENTIALS_FILE) is preferred over the JSON string
+    (GOOGLE_CREDENTIALS_JSON). The key is parsed only once per process;
+    credentials for other scopes are derived from the same parsed key.
+    
+    Args:
+        scopes: OAuth scopes the credentials should carry
+        credentials_json: Service account JSON string or dict (defaults to env)
+        credentials_file: Path to service account key file (defaults to env)
+        
+    Returns:
+        google.oauth2.service_account.Credentials
+    """
+    from google.oauth2.service_account import Credentials
+    
+    credentials_file = credentials_file or os.getenv("GOOGLE_CREDENTIALS_FILE")
+    if credentials_file:
+        source = ('file', credentials_file)
+    else:
+        credentials_json = credentials_json or os.getenv("GOOGLE_CREDENTIALS_JSON")
+        if not credentials_json:
+            raise ValueError("Set GOOGLE_CREDENTIALS_FILE or GOOGLE_CREDENTIALS_JSON")
+        if not isinstance(credentials_json, str):
+            credentials_json = json_codec.dumps(credentials_json).decode('utf-8')
+        source = ('json', credentials_json)
+    
+    key = (source, tuple(scopes))
+    with _creds_lock:
+        credentials = _creds_cache.get(key)
+        if credentials is not None:
+            return credentials
+        
+        base = _creds_cache.get((source, None))
+        if base is None:
+            if source[0] == 'file':
+                base = Credentials.from_service_account_file(credentials_file)
+            else:
+                base = Credentials.from_service_account_info(json_codec.loads(credentials_json))
+            _creds_cache[(source, None)] = base
+        
+        credentials = base.with_scopes(scopes)
+        _creds_cache[key] = credentials
+        return credentials
@@ -5,52 +5,118 @@ Uploads TikTok videos to company Google Drive storage
 """
 
 import os
-import json
-from typing import Optional
+import logging
+import mimetypes
+import threading
+import time
+from typing import Optional, List, Dict, Tuple
+
+import requests
+
+from google_credentials import get_credentials
+
+logger = logging.getLogger(__name__)
+
+# Not in the default MIME table on older Python versions
+mimetypes.add_type('image/webp', '.webp')
 
 
 class GoogleDriveUploader:
     """Uploads files to Google Drive"""
     
-    def __init__(self, credentials_json: str = None, folder_id: str = None):
+    # Files up to this size go up in a single multipart request; larger files
+    # use a resumable session (one extra round trip, but survives failures)
+    _RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+    
+    # Chunk size for resumable uploads
+    _CHUNK_SIZE = 8 * 1024 * 1024
+    
+    # Retries (exponential backoff with jitter) on 5xx/429 responses
+    _NUM_RETRIES = 5
+    
+    # Responses after which a resumable upload chunk is retried
+    _RETRY_STATUSES = (429, 500, 502, 503, 504)
+    
+    # Max number of calls Drive accepts in one batch request
+    _BATCH_LIMIT = 100
+    
+    # Permission granted to uploaded files (anyone with link can view)
+    _PUBLIC_PERMISSION = {'type': 'anyone', 'role': 'reader'}
+    
+    # Socket timeout (seconds) for Drive API connections
+    _HTTP_TIMEOUT = 120
+    
+    # Connect/read timeout (seconds) when fetching a video to stream
+    _DOWNLOAD_TIMEOUT = (5, 60)
+    
+    # Drive REST endpoint for resumable uploads fed from a stream
+    _RESUMABLE_UPLOAD_URL = 'https://www.googleapis.com/upload/drive/v3/files'
+    
+    def __init__(
+        self,
+        credentials_json: str = None,
+        folder_id: str = None,
+        credentials_file: str = None,
+        pool_size: int = 20,
+        download_session: Optional[requests.Session] = None
+    ):
         """
         Initialize Google Drive uploader
         
         Args:
             credentials_json: Google service account credentials (JSON string)
             folder_id: Google Drive folder ID where files will be uploaded
+            credentials_file: Path to service account key file (preferred over JSON string)
+            pool_size: Connections kept for streamed uploads; use the number
+                of threads uploading at once
+            download_session: Session for fetching streamed videos, so the
+                CDN connections are shared with other downloads (a new one
+                is created if not given)
         """
         self.credentials_json = credentials_json or os.getenv("GOOGLE_CREDENTIALS_JSON")
+        self.credentials_file = credentials_file or os.getenv("GOOGLE_CREDENTIALS_FILE")
         self.folder_id = folder_id or os.getenv("GOOGLE_DRIVE_FOLDER_ID")
+        self.pool_size = pool_size
+        self._download_session = download_session or requests.Session()
+        
+        # Pooled AuthorizedSession (thread-safe) used for streamed uploads
+        self._session = None
+        self._session_lock = threading.Lock()
         
-        self._service = None
+        # httplib2 (used by googleapiclient) is not thread-safe, so every
+        # worker thread gets its own Drive service instance
+        self._local = threading.local()
+        
+        # True if the folder is already shared "anyone with link"; files
+        # inherit that, so no per-file permission is needed (checked once)
+        self._folder_public: Optional[bool] = None
+    
+    @property
+    def _service(self):
+        """Google Drive API service for the calling thread"""
+        return getattr(self._local, 'service', None)
     
     def _init_service(self):
-        """Initialize Google Drive API service"""
+        """Initialize Google Drive API service for the calling thread"""
         if self._service is not None:
             return
         
         try:
+            import httplib2
+            import google_auth_httplib2
             from googleapiclient.discovery import build
-            from google.oauth2.service_account import Credentials
             
-            # Parse credentials from JSON string
-            if isinstance(self.credentials_json, str):
-                creds_dict = json.loads(self.credentials_json)
-            else:
-                creds_dict = self.credentials_json
-            
-            # Define the scope
-            scopes = ['https://www.googleapis.com/auth/drive.file']
-            
-            # Create credentials
-            credentials = Credentials.from_service_account_info(
-                creds_dict,
-                scopes=scopes
+            # Keep-alive connection reused for every call made by this thread
+            http = google_auth_httplib2.AuthorizedHttp(
+                self._get_credentials(),
+                http=httplib2.Http(timeout=self._HTTP_TIMEOUT)
             )
             
             # Build the service
-            self._service = build('drive', 'v3', credentials=credentials)
+            self._local.service = build('drive', 'v3', http=http, cache_discovery=False)
+            
+            if self._folder_public is None:
+                self._folder_public = self._check_folder_public()
             
         except ImportError:
             raise ImportError(
@@ -58,11 +124,99 @@ class GoogleDriveUploader:
                 "Run: pip install google-api-python-client google-auth"
             )
     
+    def _check_folder_public(self) -> bool:
+        """Check whether the upload folder is shared with anyone who has the link"""
+        if not self.folder_id:
+            return False
+        
+        try:
+            result = self._service.permissions().list(
+                fileId=self.folder_id,
+                fields='permissions(type, role)',
+                supportsAllDrives=True
+            ).execute(num_retries=self._NUM_RETRIES)
+        except Exception as e:
+            logger.info(f"Could not read folder permissions, sharing files individually: {e}")
+            return False
+        
+        public = any(p.get('type') == 'anyone' for p in result.get('permissions', []))
+        if public:
+            logger.info("Drive folder is public - uploaded files inherit its link sharing")
+        return public
+    
+    def _get_credentials(self):
+        """Service account credentials, shared by all threads (and with Google Sheets)"""
+        return get_credentials(
+            ['https://www.googleapis.com/auth/drive.file'],
+            credentials_json=self.credentials_json,
+            credentials_file=self.credentials_file
+        )
+    
+    def _get_session(self):
+        """Authorized requests session with connection pooling for raw REST uploads"""
+        with self._session_lock:
+            if self._session is not None:
+                return self._session
+        
+        from google.auth.transport.requests import AuthorizedSession
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        
+        session = AuthorizedSession(self._get_credentials())
+        # Only retry requests that never reached Drive; 5xx/429 responses are
+        # handled by _send_buffered(), which asks Drive how much it kept first
+        retries = Retry(
+            total=self._NUM_RETRIES,
+            read=0,
+            backoff_factor=0.5,
+            allowed_methods=['PUT'],
+            raise_on_status=False
+        )
+        session.mount('https://', HTTPAdapter(pool_maxsize=self.pool_size, max_retries=retries))
+        
+        with self._session_lock:
+            if self._session is None:
+                self._session = session
+            return self._session
+    
+    def _file_metadata(self, name: str, description: Optional[str]) -> Dict:
+        """Build Drive file metadata (name, description, parent folder)"""
+        file_metadata = {
+            'name': name,
+        }
+        
+        # Add description if provided
+        if description:
+            file_metadata['description'] = description
+        
+        # Add to folder if specified
+        if self.folder_id:
+            file_metadata['parents'] = [self.folder_id]
+        
+        return file_metadata
+    
+    def _share_file(self, file_id: str, pending_shares: Optional[List[str]]):
+        """Make file shareable (anyone with link can view), now or via share_files()"""
+        self._init_service()
+        if self._folder_public:
+            return
+        
+        if pending_shares is not None:
+            pending_shares.append(file_id)
+            return
+        
+        self._service.permissions().create(
+            fileId=file_id,
+            body=self._PUBLIC_PERMISSION,
+            supportsAllDrives=True
+        ).execute(num_retries=self._NUM_RETRIES)
+    
     def upload_video(
         self,
         file_path: str,
         filename: Optional[str] = None,
-        description: Optional[str] = None
+        description: Optional[str] = None,
+        pending_shares: Optional[List[str]] = None
     ) -> Optional[str]:
         """
         Upload a video file to Google Drive
@@ -71,81 +225,312 @@ class GoogleDriveUploader:
             file_path: Path to the video file to upload
             filename: Custom filename (optional, uses original if not provided)
             description: File description/metadata
+            pending_shares: If given, the file ID is appended here instead of
+                sharing the file right away; pass the list to share_files() later
             
         Returns:
             Shareable URL to the uploaded file, or None if upload fails
         """
         if not os.path.exists(file_path):
-            print(f"Error: File not found: {file_path}")
+            logger.error(f"File not found: {file_path}")
             return None
         
         self._init_service()
         
+        import httplib2
+        from googleapiclient.errors import HttpError
+        from googleapiclient.http import MediaFileUpload
+        
         try:
-            from googleapiclient.http import MediaFileUpload
-            
             # Prepare file metadata
-            file_metadata = {
-                'name': filename or os.path.basename(file_path),
-            }
-            
-            # Add description if provided
-            if description:
-                file_metadata['description'] = description
+            file_metadata = self._file_metadata(filename or os.path.basename(file_path), description)
             
-            # Add to folder if specified
-            if self.folder_id:
-                file_metadata['parents'] = [self.folder_id]
-            
-            # Determine MIME type
-            mime_type = 'video/mp4'
-            if file_path.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
-                mime_type = 'image/jpeg'
+            # Determine MIME type from the extension (plain dict lookup)
+            _, extension = os.path.splitext(file_path)
+            mime_type = mimetypes.types_map.get(extension.lower(), 'application/octet-stream')
             
             # Upload file
             media = MediaFileUpload(
                 file_path,
                 mimetype=mime_type,
-                resumable=True
+                resumable=os.path.getsize(file_path) > self._RESUMABLE_THRESHOLD,
+                chunksize=self._CHUNK_SIZE
             )
             
-            print(f"Uploading {filename or os.path.basename(file_path)} to Google Drive...")
+            logger.info(f"Uploading {filename or os.path.basename(file_path)} to Google Drive...")
             
             file = self._service.files().create(
                 body=file_metadata,
                 media_body=media,
                 fields='id, webViewLink, webContentLink',
                 supportsAllDrives=True
-            ).execute()
+            ).execute(num_retries=self._NUM_RETRIES)
+            
+            # Make file shareable (anyone with link can view)
+            self._share_file(file.get('id'), pending_shares)
+            
+            # Get shareable link
+            share_link = file.get('webViewLink') or file.get('webContentLink')
             
-            file_id = file.get('id')
+            logger.info(f"✓ Uploaded successfully: {share_link}")
+            return share_link
+            
+        except (HttpError, httplib2.HttpLib2Error, OSError):
+            logger.exception("Error uploading to Google Drive")
+            return None
+    
+    def upload_video_from_stream(
+        self,
+        url: str,
+        filename: str,
+        description: Optional[str] = None,
+        pending_shares: Optional[List[str]] = None
+    ) -> Optional[str]:
+        """
+        Stream a video from a URL straight into Google Drive without touching disk
+        
+        The download is piped into a resumable upload session chunk by chunk,
+        so uploading starts as soon as the first chunk has arrived.
+        
+        Args:
+            url: Direct URL to the video file
+            filename: Name of the file in Google Drive
+            description: File description/metadata
+            pending_shares: If given, the file ID is appended here instead of
+                sharing the file right away; pass the list to share_files() later
+            
+        Returns:
+            Shareable URL to the uploaded file, or None if the URL did not
+            serve a video or the upload failed (callers should fall back to
+            downloading the file first)
+        """
+        try:
+            session = self._get_session()
+            
+            with self._download_session.get(url, stream=True, timeout=self._DOWNLOAD_TIMEOUT) as source:
+                source.raise_for_status()
+                
+                mime_type = source.headers.get('Content-Type', '').split(';')[0].strip().lower()
+                if not mime_type.startswith('video/'):
+                    logger.info(f"Not a video ({mime_type or 'unknown type'}), skipping streamed upload of {filename}")
+                    return None
+                
+                # Open resumable upload session
+                init = session.post(
+                    self._RESUMABLE_UPLOAD_URL,
+                    params={
+                        'uploadType': 'resumable',
+                        'supportsAllDrives': 'true',
+                        'fields': 'id, webViewLink, webContentLink'
+                    },
+                    json=self._file_metadata(filename, description),
+                    headers={'X-Upload-Content-Type': mime_type},
+                    timeout=self._HTTP_TIMEOUT
+                )
+                init.raise_for_status()
+                upload_url = init.headers['Location']
+                
+                logger.info(f"Streaming {filename} to Google Drive...")
+                
+                # Every chunk except the last must be a multiple of 256KB, so
+                # buffer until a full chunk is available (and keep the tail
+                # for the final request, which also announces the total size).
+                # buffer always starts at byte `offset`, the first byte Drive
+                # has not confirmed yet.
+                buffer = bytearray()
+                offset = 0
+                for data in source.iter_content(chunk_size=1024 * 1024):
+                    buffer += data
+                    while len(buffer) > self._CHUNK_SIZE:
+                        offset, _ = self._send_buffered(session, upload_url, buffer, offset)
+                
+                if offset == 0 and not buffer:
+                    logger.error(f"Empty response body for {filename}")
+                    return None
+                
+                total = offset + len(buffer)
+                _, response = self._send_buffered(session, upload_url, buffer, offset, total=total)
+                file = response.json()
             
             # Make file shareable (anyone with link can view)
-            self._service.permissions().create(
-                fileId=file_id,
-                body={
-                    'type': 'anyone',
-                    'role': 'reader'
-                },
-                supportsAllDrives=True
-            ).execute()
+            self._share_file(file.get('id'), pending_shares)
             
             # Get shareable link
             share_link = file.get('webViewLink') or file.get('webContentLink')
             
-            print(f"✓ Uploaded successfully: {share_link}")
+            logger.info(f"✓ Streamed successfully: {share_link}")
             return share_link
             
-        except Exception as e:
-            print(f"Error uploading to Google Drive: {e}")
+        except (requests.RequestException, KeyError, ValueError):
+            logger.exception("Error streaming to Google Drive")
             return None
     
+    def _put_chunk(self, session, upload_url: str, chunk: bytes, offset: int, total: Optional[int] = None):
+        """
+        Send one chunk of a resumable upload
+        
+        Args:
+            session: Authorized requests session
+            upload_url: Resumable session URL from the initiating request
+            chunk: Bytes to send
+            offset: Byte offset of the chunk in the file
+            total: Total file size for the final chunk, None while still streaming
+            
+        Returns:
+            The response (308 for intermediate chunks, 200/201 when complete,
+            or a retryable 5xx/429 error)
+        """
+        content_range = f"bytes {offset}-{offset + len(chunk) - 1}/{total if total is not None else '*'}"
+        return self._put_upload(session, upload_url, chunk, content_range)
+    
+    def _query_upload_status(self, session, upload_url: str, total: Optional[int] = None):
+        """Ask Drive how many bytes of a resumable upload it has stored (308 + Range header)"""
+        content_range = f"bytes */{total if total is not None else '*'}"
+        return self._put_upload(session, upload_url, b'', content_range)
+    
+    def _put_upload(self, session, upload_url: str, data: bytes, content_range: str):
+        """PUT to a resumable session URL, raising on anything but 308, success or a retryable error"""
+        response = session.put(
+            upload_url,
+            data=data,
+            headers={'Content-Range': content_range},
+            timeout=self._HTTP_TIMEOUT,
+            allow_redirects=False
+        )
+        if response.status_code != 308 and response.status_code not in self._RETRY_STATUSES:
+            response.raise_for_status()
+        return response
+    
+    @staticmethod
+    def _confirmed_bytes(response) -> int:
+        """Number of bytes Drive has stored, from the Range header of a 308 response"""
+        # e.g. "bytes=0-8388607"; no header means nothing was stored yet
+        byte_range = response.headers.get('Range')
+        if not byte_range:
+            return 0
+        return int(byte_range.rsplit('-', 1)[1]) + 1
+    
+    def _send_buffered(
+        self,
+        session,
+        upload_url: str,
+        buffer: bytearray,
+        offset: int,
+        total: Optional[int] = None
+    ) -> Tuple[int, requests.Response]:
+        """
+        Send the start of buffer and drop the bytes Drive confirmed from it
+        
+        Drive may store less than it was sent, so the Range header of every
+        308 decides where the next chunk starts; after a 5xx/429 the upload
+        status is queried before anything is resent.
+        
+        Args:
+            session: Authorized requests session
+            upload_url: Resumable session URL from the initiating request
+            buffer: Unconfirmed bytes, starting at offset (modified in place)
+            offset: Byte offset of the first byte in buffer
+            total: Total file size once the stream has ended; everything left
+                in buffer is then sent until the upload completes
+            
+        Returns:
+            Tuple of the new offset and the last response
+            
+        Raises:
+            requests.HTTPError: If Drive keeps failing after _NUM_RETRIES attempts
+            ValueError: If Drive stops making progress or reports an impossible range
+        """
+        failures = 0
+        while True:
+            chunk = bytes(buffer) if total is not None else bytes(buffer[:self._CHUNK_SIZE])
+            if chunk:
+                response = self._put_chunk(session, upload_url, chunk, offset, total)
+            else:
+                # Every byte is confirmed (no valid range left to send); ask
+                # Drive for the result of the finished upload instead
+                response = self._query_upload_status(session, upload_url, total)
+            
+            if response.status_code in self._RETRY_STATUSES:
+                failures += 1
+                if failures > self._NUM_RETRIES:
+                    response.raise_for_status()
+                time.sleep(0.5 * 2 ** (failures - 1))
+                # Part of the chunk may have been stored; resume from what Drive confirms
+                response = self._query_upload_status(session, upload_url, total)
+                if response.status_code in self._RETRY_STATUSES:
+                    continue
+            
+            if response.status_code != 308:
+                return offset + len(buffer), response
+            
+            confirmed = self._confirmed_bytes(response)
+            if not offset <= confirmed <= offset + len(chunk):
+                raise ValueError(f"Unexpected upload range from Drive: {response.headers.get('Range')}")
+            
+            if confirmed == offset:
+                failures += 1
+                if failures > self._NUM_RETRIES:
+                    raise ValueError(f"Drive stopped accepting data at byte {offset}")
+                continue
+            
+            del buffer[:confirmed - offset]
+            offset = confirmed
+            failures = 0
+            if total is None:
+                return offset, response
+    
+    def share_files(self, file_ids: List[str]) -> int:
+        """
+        Make several uploaded files shareable using batched permission requests
+        
+        Args:
+            file_ids: Google Drive file IDs collected via upload_video(pending_shares=...)
+            
+        Returns:
+            Number of files that were shared successfully
+        """
+        if not file_ids:
+            return 0
+        
+        self._init_service()
+        if self._folder_public:
+            return len(file_ids)
+        
+        shared = 0
+        
+        def on_response(request_id, response, exception):
+            nonlocal shared
+            if exception is not None:
+                logger.error(f"Error sharing file {request_id}: {exception}")
+            else:
+                shared += 1
+        
+        for start in range(0, len(file_ids), self._BATCH_LIMIT):
+            batch = self._service.new_batch_http_request(callback=on_response)
+            for file_id in file_ids[start:start + self._BATCH_LIMIT]:
+                batch.add(
+                    self._service.permissions().create(
+                        fileId=file_id,
+                        body=self._PUBLIC_PERMISSION,
+                        supportsAllDrives=True
+                    ),
+                    request_id=file_id
+                )
+            try:
+                batch.execute()
+            except Exception as e:
+                logger.error(f"Error executing share batch: {e}")
+        
+        logger.info(f"✓ Shared {shared}/{len(file_ids)} files")
+        return shared
+    
     def upload_story(
         self,
         file_path: str,
         username: str,
         story_id: str,
-        caption: Optional[str] = None
+        caption: Optional[str] = None,
+        pending_shares: Optional[List[str]] = None
     ) -> Optional[str]:
         """
         Upload a TikTok story with proper naming and metadata
@@ -155,6 +540,7 @@ class GoogleDriveUploader:
             username: TikTok username
             story_id: TikTok story/video ID
             caption: Story caption for description
+            pending_shares: Collects file IDs for a later share_files() call
             
         Returns:
             Shareable URL to the uploaded file
@@ -163,17 +549,49 @@ class GoogleDriveUploader:
         extension = os.path.splitext(file_path)[1]
         filename = f"tiktok_{username}_{story_id}{extension}"
         
-        # Create description
-        description = f"TikTok video from @{username}"
-        if caption:
-            description += f"\n\n{caption}"
-        
         return self.upload_video(
             file_path=file_path,
             filename=filename,
-            description=description
+            description=self._story_description(username, caption),
+            pending_shares=pending_shares
         )
     
+    def upload_story_from_url(
+        self,
+        url: str,
+        username: str,
+        story_id: str,
+        caption: Optional[str] = None,
+        pending_shares: Optional[List[str]] = None
+    ) -> Optional[str]:
+        """
+        Stream a TikTok video story from its URL into Google Drive
+        
+        Args:
+            url: Direct video URL
+            username: TikTok username
+            story_id: TikTok story/video ID
+            caption: Story caption for description
+            pending_shares: Collects file IDs for a later share_files() call
+            
+        Returns:
+            Shareable URL to the uploaded file, or None if streaming was not possible
+        """
+        return self.upload_video_from_stream(
+            url=url,
+            filename=f"tiktok_{username}_{story_id}.mp4",
+            description=self._story_description(username, caption),
+            pending_shares=pending_shares
+        )
+    
+    @staticmethod
+    def _story_description(username: str, caption: Optional[str]) -> str:
+        """Create Drive description for a TikTok story"""
+        description = f"TikTok video from @{username}"
+        if caption:
+            description += f"\n\n{caption}"
+        return description
+    
     def is_configured(self) -> bool:
         """
         Check if Google Drive is properly configured
@@ -181,7 +599,7 @@ class GoogleDriveUploader:
         Returns:
             True if credentials and folder are set
         """
-        return bool(self.credentials_json and self.folder_id)
+        return bool((self.credentials_json or self.credentials_file) and self.folder_id)
 
 
 def main():
@@ -189,7 +607,7 @@ def main():
     uploader = GoogleDriveUploader()
     
     if not uploader.is_configured():
-        print("Google Drive not configured. Set GOOGLE_CREDENTIALS_JSON and GOOGLE_DRIVE_FOLDER_ID")
+        print("Google Drive not configured. Set GOOGLE_CREDENTIALS_JSON (or GOOGLE_CREDENTIALS_FILE) and GOOGLE_DRIVE_FOLDER_ID")
         return
     
     # Test with a sample file
@@ -207,4 +625,5 @@ def main():
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     main()
@@ -5,41 +5,70 @@ Fetches list of monitored TikTok accounts from Google Sheet
 """
 
 import os
-from typing import List, Dict
+import time
+import tempfile
+import threading
+from typing import List, Dict, Optional
 import json
 
+from google_credentials import get_credentials
+
+# Authorized gspread client shared by all monitors in this process,
+# so the service account token exchange only happens once
+_CLIENT_SINGLETON = None
+_CLIENT_LOCK = threading.Lock()
+
 
 class GoogleSheetsMonitor:
     """Fetches monitored accounts from Google Sheets"""
     
-    def __init__(self, sheet_url: str = None, credentials_json: str = None):
+    # A1 range without sheet name = first visible worksheet
+    _ACCOUNTS_RANGE = 'A:Z'
+    
+    def __init__(
+        self,
+        sheet_url: str = None,
+        credentials_json: str = None,
+        cache_path: str = None,
+        cache_ttl: int = None,
+        credentials_file: str = None
+    ):
         """
         Initialize Google Sheets monitor
         
         Args:
             sheet_url: Google Sheet URL or ID
             credentials_json: Google service account credentials (JSON string)
+            cache_path: Where the last fetched account list is cached on disk
+            cache_ttl: Seconds a cached account list is used before refetching
+            credentials_file: Path to service account key file (preferred over JSON string)
         """
         self.sheet_url = sheet_url or os.getenv("GOOGLE_SHEET_URL")
         self.credentials_json = credentials_json or os.getenv("GOOGLE_CREDENTIALS_JSON")
+        self.credentials_file = credentials_file or os.getenv("GOOGLE_CREDENTIALS_FILE")
+        self._cache_path = cache_path or os.getenv("ACCOUNTS_CACHE_PATH", "/tmp/tiktok_accounts.json")
+        self._ttl = cache_ttl if cache_ttl is not None else int(os.getenv("ACCOUNTS_CACHE_TTL", "300"))
         
         self._client = None
         self._sheet = None
     
     def _init_client(self):
-        """Initialize Google Sheets API client"""
+        """Initialize Google Sheets API client (reuses the process-wide client)"""
+        global _CLIENT_SINGLETON
+        
         if self._client is not None:
             return
         
+        with _CLIENT_LOCK:
+            if _CLIENT_SINGLETON is None:
+                _CLIENT_SINGLETON = self._create_client()
+            self._client = _CLIENT_SINGLETON
+    
+    def _create_client(self):
+        """Authorize a new gspread client with a pooled keep-alive HTTP session"""
         try:
             import gspread
-            from google.oauth2.service_account import Credentials
-            
-            # Parse credentials from JSON string
-            if isinstance(self.credentials_json, str):
-                creds_dict = json.loads(self.credentials_json)
-            else:
-                creds_dict = self.credentials_json
+            from requests.adapters import HTTPAdapter
             
             # Define the scope
             scopes = [
@@ -47,14 +76,22 @@ class GoogleSheetsMonitor:
                 'https://www.googleapis.com/auth/drive.readonly'
             ]
             
-            # Create credentials
-            credentials = Credentials.from_service_account_info(
-                creds_dict,
-                scopes=scopes
+            # Create credentials (key is parsed once and shared with Google Drive)
+            credentials = get_credentials(
+                scopes,
+                credentials_json=self.credentials_json,
+                credentials_file=self.credentials_file
             )
             
             # Create client
-            self._client = gspread.authorize(credentials)
+            client = gspread.authorize(credentials)
+            
+            # gspread 5.x exposes the session directly, 6.x via its HTTP client
+            session = getattr(getattr(client, 'http_client', client), 'session', None)
+            if session is not None:
+                session.mount('https://', HTTPAdapter(pool_maxsize=20))
+            
+            return client
             
         except ImportError:
             raise ImportError(
@@ -75,6 +112,10 @@ class GoogleSheetsMonitor:
         Returns:
             List of account dictionaries with 'username' and 'enabled' keys
         """
+        cached = self._read_cache(max_age=self._ttl)
+        if cached is not None:
+            return cached
+        
         self._init_client()
         
         try:
@@ -84,11 +125,10 @@ class GoogleSheetsMonitor:
             else:
                 self._sheet = self._client.open_by_key(self.sheet_url)
             
-            # Get first worksheet
-            worksheet = self._sheet.get_worksheet(0)
-            
-            # Get all records as dictionaries
-            records = worksheet.get_all_records(expected_headers=['Username'])
+            # Get all values of the first worksheet in one API call
+            response = self._sheet.values_batch_get(ranges=[self._ACCOUNTS_RANGE])
+            rows = response.get('valueRanges', [{}])[0].get('values', [])
+            records = self._rows_to_records(rows)
             
             # Filter and format accounts
             accounts = []
@@ -103,13 +143,72 @@ class GoogleSheetsMonitor:
                         'notes': notes
                     })
             
+            self._write_cache(accounts)
             return accounts
             
         except Exception as e:
             print(f"Error fetching accounts from Google Sheets: {e}")
+            # Prefer the last known list from Sheets, even if it is stale
+            stale = self._read_cache()
+            if stale:
+                return stale
             # Fallback to hardcoded list if Sheets unavailable
             return self._get_fallback_accounts()
     
+    @staticmethod
+    def _rows_to_records(rows: List[List[str]]) -> List[Dict[str, str]]:
+        """
+        Map raw sheet rows to dicts keyed by the header row
+        
+        Args:
+            rows: 2D list of cell values, first row is the header
+            
+        Returns:
+            One dict per data row
+        """
+        if not rows:
+            return []
+        
+        headers = [str(h).strip() for h in rows[0]]
+        if 'Username' not in headers:
+            raise ValueError(f"Sheet is missing the 'Username' header (found: {headers})")
+        
+        records = []
+        for row in rows[1:]:
+            # The API omits trailing empty cells
+            padded = list(row) + [''] * (len(headers) - len(row))
+            records.append(dict(zip(headers, padded)))
+        return records
+    
+    def _read_cache(self, max_age: Optional[int] = None) -> Optional[List[Dict[str, str]]]:
+        """
+        Read the cached account list
+        
+        Args:
+            max_age: Ignore the cache if it is older than this many seconds (None = any age)
+            
+        Returns:
+            Cached accounts, or None if missing, expired or unreadable
+        """
+        try:
+            if max_age is not None and os.path.getmtime(self._cache_path) <= time.time() - max_age:
+                return None
+            with open(self._cache_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _write_cache(self, accounts: List[Dict[str, str]]):
+        """Atomically write the account list to the cache file"""
+        try:
+            cache_dir = os.path.dirname(self._cache_path) or '.'
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(accounts, f)
+            os.replace(tmp_path, self._cache_path)
+        except OSError as e:
+            print(f"Could not write accounts cache: {e}")
+    
     def _get_fallback_accounts(self) -> List[Dict[str, str]]:
         """
         Fallback accounts when Google Sheets is unavailable
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+JSON Codec
+Fast JSON encoding/decoding via orjson, with the stdlib json module as fallback
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """
+    Parse a JSON document
+    
+    Args:
+        data: JSON as str or bytes
+        
+    Returns:
+        The decoded Python object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> bytes:
+    """
+    Serialize an object to JSON
+    
+    Args:
+        obj: JSON-serializable object
+        
+    Returns:
+        UTF-8 encoded JSON bytes (ready to send as a request body)
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
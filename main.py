@@ -6,9 +6,12 @@ Monitors TikTok accounts, downloads videos, and sends Slack alerts (BATCH OPTIMI
 
 import os
 import sys
+import asyncio
 import logging
+import logging.handlers
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from dotenv import load_dotenv
 
 from apify_client import ApifyClient
@@ -17,20 +20,42 @@ from google_sheets import GoogleSheetsMonitor
 from google_drive import GoogleDriveUploader
 from slack_notifier import SlackNotifier
 # VIKTIG ENDRING HER: Vi importerer den nye batch-funksjonen
-from tiktok_story_downloader import fetch_tiktok_stories_batch, download_story_media, DOWNLOAD_DIR
+from tiktok_story_downloader import (
+    fetch_tiktok_stories_batch_async, download_story_media, get_video_url,
+    configure_download_pool, get_download_session, DOWNLOAD_DIR
+)
 
 
 # Configure logging
+# Console output is buffered and flushed every 100 records (or immediately on
+# errors); the log file is only opened once the first record is written.
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format=LOG_FORMAT,
     handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('tiktok_monitor.log')
+        logging.handlers.MemoryHandler(capacity=100, flushLevel=logging.ERROR, target=_console_handler),
+        logging.FileHandler('tiktok_monitor.log', delay=True)
     ]
 )
 logger = logging.getLogger(__name__)
 
+# Max number of accounts processed at the same time
+MAX_CONCURRENT_ACCOUNTS = int(os.getenv("MAX_CONCURRENT_ACCOUNTS", "8"))
+
+# Max number of stories processed at the same time within one account
+MAX_CONCURRENT_STORIES = int(os.getenv("MAX_CONCURRENT_STORIES", "4"))
+
+# Threads for blocking work (downloads, uploads, state store) run through
+# asyncio.to_thread. Sized so every concurrently processed story gets one;
+# the loop's default pool (min(32, CPUs + 4)) would otherwise be the real cap.
+MAX_BLOCKING_WORKERS = MAX_CONCURRENT_ACCOUNTS * MAX_CONCURRENT_STORIES
+
+# Background threads delivering Slack notifications
+SLACK_WORKERS = 4
+
 
 class TikTokMonitor:
     """Main orchestration class for TikTok monitoring"""
@@ -42,25 +67,55 @@ class TikTokMonitor:
         self.apify_token = os.getenv("APIFY_API_TOKEN")
         self.state_store = StateStore(db_path=os.getenv("STATE_DB_PATH", "tiktok_state.db"))
         self.sheets_monitor = GoogleSheetsMonitor()
-        self.drive_uploader = GoogleDriveUploader()
+        # Connection pools get one connection per worker thread
+        configure_download_pool(MAX_BLOCKING_WORKERS)
+        self.drive_uploader = GoogleDriveUploader(
+            pool_size=MAX_BLOCKING_WORKERS,
+            download_session=get_download_session()
+        )
         self.slack_notifier = SlackNotifier()
         
         if not self.apify_token:
             raise ValueError("APIFY_API_TOKEN is required")
         
+        # Serializes state store writes from concurrently processed stories.
+        # Created in run_async() so it binds to the running event loop.
+        self._state_lock: Optional[asyncio.Lock] = None
+        
+        # Slack notifications are sent in the background; created per run
+        self._slack_executor: Optional[ThreadPoolExecutor] = None
+        
+        # Posts whose Slack alert went out, flagged in one write after the run
+        self._slack_sent_ids: List[str] = []
+        
+        # Configuration doesn't change during a run, so check it once
+        self._drive_ok = self.drive_uploader.is_configured()
+        self._slack_ok = self.slack_notifier.is_configured()
+        
         logger.info("TikTok Monitor initialized")
-        logger.info(f"Google Drive configured: {self.drive_uploader.is_configured()}")
-        logger.info(f"Slack configured: {self.slack_notifier.is_configured()}")
+        logger.info(f"Google Drive configured: {self._drive_ok}")
+        logger.info(f"Slack configured: {self._slack_ok}")
     
     def run(self):
-        """Main execution flow - BATCH OPTIMIZED"""
+        """Synchronous wrapper around run_async()"""
+        return asyncio.run(self.run_async())
+    
+    async def run_async(self):
+        """Main execution flow - BATCH OPTIMIZED, accounts processed concurrently"""
         logger.info("=" * 60)
         logger.info("Starting TikTok monitoring cycle (Batch Mode)")
         logger.info("=" * 60)
         
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=MAX_BLOCKING_WORKERS, thread_name_prefix="worker")
+        )
+        self._state_lock = asyncio.Lock()
+        self._slack_executor = ThreadPoolExecutor(max_workers=SLACK_WORKERS, thread_name_prefix="slack")
+        self._slack_sent_ids = []
+        
         try:
             # Step 1: Get monitored accounts from Sheets
-            accounts = self._get_monitored_accounts()
+            accounts = await asyncio.to_thread(self._get_monitored_accounts)
             if not accounts:
                 logger.warning("No accounts to monitor. Exiting.")
                 return 0
@@ -70,20 +125,28 @@ class TikTokMonitor:
             logger.info(f"Found {len(usernames)} accounts to monitor in Google Sheets")
             
             # Step 2: Fetch ALL stories in ONE Apify call (Saves money!)
+            # Set APIFY_BATCH_SIZE to split into concurrent runs instead
             logger.info("Fetching data from Apify for all users...")
-            all_stories = fetch_tiktok_stories_batch(usernames, self.apify_token)
+            all_stories = await fetch_tiktok_stories_batch_async(usernames, self.apify_token)
             
             logger.info(f"Apify returned {len(all_stories)} total stories across all users")
             
-            # Step 3: Process the results
-            total_new_posts = 0
+            # Step 3: Group the results per account and process the accounts concurrently
+            stories_by_user: Dict[str, List[Dict]] = {}
             for story in all_stories:
-                # Get username from story data
                 username = story.get('unique_id', 'unknown')
-                
-                # Check if this story is new
-                if self._process_story(username, story):
-                    total_new_posts += 1
+                stories_by_user.setdefault(username, []).append(story)
+            
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_ACCOUNTS)
+            tasks = [
+                asyncio.create_task(self._process_account(username, stories, semaphore))
+                for username, stories in stories_by_user.items()
+            ]
+            results = await asyncio.gather(*tasks)
+            total_new_posts = sum(results)
+            
+            # Wait until all queued Slack notifications are delivered
+            await asyncio.to_thread(self._slack_executor.shutdown, True)
             
             logger.info("=" * 60)
             logger.info(f"Monitoring cycle complete: {total_new_posts} new posts processed and downloaded")
@@ -94,6 +157,68 @@ class TikTokMonitor:
         except Exception as e:
             logger.error(f"Error in monitoring cycle: {e}", exc_info=True)
             raise
+        finally:
+            await asyncio.to_thread(self._slack_executor.shutdown, True)
+            await asyncio.to_thread(self.state_store.mark_slack_sent_many, self._slack_sent_ids)
+            self.state_store.close()
+    
+    async def _process_account(self, username: str, stories: List[Dict], semaphore: asyncio.Semaphore) -> int:
+        """
+        Process all stories for one account
+        
+        Returns:
+            Number of new posts processed
+        """
+        async with semaphore:
+            # Check all posts against the state store in one query (avoids re-downloading!)
+            post_ids = [str(story.get('aweme_id') or story.get('video_id') or '') for story in stories]
+            unprocessed = await asyncio.to_thread(
+                self.state_store.filter_unprocessed,
+                [post_id for post_id in post_ids if post_id]
+            )
+            
+            new_stories = []
+            for story, post_id in zip(stories, post_ids):
+                if not post_id:
+                    logger.warning(f"Found story without ID for {username}. Skipping.")
+                elif post_id not in unprocessed:
+                    logger.debug(f"Skipping already processed post: {post_id}")
+                else:
+                    # Discard so duplicates within the batch are only processed once
+                    unprocessed.discard(post_id)
+                    new_stories.append((post_id, story))
+            
+            # Drive permissions are collected per account and granted in one batch
+            pending_shares: List[str] = []
+            story_semaphore = asyncio.Semaphore(MAX_CONCURRENT_STORIES)
+            
+            async def process(post_id: str, story: Dict) -> Optional[Dict]:
+                async with story_semaphore:
+                    return await self._process_story(username, post_id, story, pending_shares)
+            
+            results = await asyncio.gather(*[process(post_id, story) for post_id, story in new_stories])
+            new_posts = [(post_id, post) for (post_id, _), post in zip(new_stories, results) if post]
+            
+            # Wait until the posts are on disk; ones that failed to save are
+            # dropped so they are retried (and alerted) on the next run instead.
+            # flush()'s result can't be used for this: accounts flush
+            # concurrently and failures aren't tracked per caller, but a failed
+            # post is always removed from is_processed() before flush() returns.
+            if new_posts:
+                await asyncio.to_thread(self.state_store.flush)
+                new_posts = [
+                    (post_id, post) for post_id, post in new_posts
+                    if self.state_store.is_processed(post_id)
+                ]
+            
+            if pending_shares:
+                await asyncio.to_thread(self.drive_uploader.share_files, pending_shares)
+            
+            # Notify only after sharing so the Drive links work when posted
+            for _, post in new_posts:
+                self._queue_slack_alert(post)
+            
+            return len(new_posts)
     
     def _get_monitored_accounts(self) -> List[Dict]:
         """Get list of accounts to monitor"""
@@ -107,85 +232,143 @@ class TikTokMonitor:
             logger.error(f"Error fetching accounts: {e}")
             return self.sheets_monitor._get_fallback_accounts()
     
-    def _process_story(self, username: str, story: Dict) -> bool:
+    async def _process_story(
+        self,
+        username: str,
+        post_id: str,
+        story: Dict,
+        pending_shares: List[str]
+    ) -> Optional[Dict]:
         """
-        Process a single story/post
+        Process a single new story/post (download, upload and save state)
+        
+        Args:
+            username: TikTok username
+            post_id: TikTok post ID, already checked against the state store
+            story: Story data from Apify
+            pending_shares: Collects uploaded Drive file IDs to be shared in batch
         
         Returns:
-            True if this was a new post, False if already processed or invalid
+            Metadata of the new post, or None if it could not be processed
         """
-        post_id = story.get('aweme_id') or story.get('video_id')
-        if not post_id:
-             logger.warning(f"Found story without ID for {username}. Skipping.")
-             return False
-             
-        # Check if already processed (avoids re-downloading!)
-        if self.state_store.is_processed(post_id):
-            logger.debug(f"Skipping already processed post: {post_id}")
-            return False
-        
         logger.info(f"Processing new post from @{username} (ID: {post_id})")
         
         metadata = self._extract_metadata(username, story)
         
+        stored, storage_url = await self._store_media(username, post_id, story, metadata, pending_shares)
+        if not stored:
+            return None
+        
+        # Save to state store so we don't download it again next time
+        async with self._state_lock:
+            success = await asyncio.to_thread(
+                self.state_store.add_post,
+                post_id=post_id,
+                author=username,
+                published_at=metadata['published_at'],
+                url=metadata['url'],
+                caption=metadata['caption'],
+                transcript=metadata.get('transcript'),
+                hashtags=metadata.get('hashtags', []),
+                storage_url=storage_url
+            )
+        
+        # add_post only queues the write; _process_account flushes before alerting
+        if not success:
+            logger.warning(f"Post already recorded in state store: {post_id}")
+            return None
+        
+        logger.info(f"✓ Successfully fully processed post: {post_id}")
+        metadata['storage_url'] = storage_url
+        return metadata
+    
+    async def _store_media(
+        self,
+        username: str,
+        post_id: str,
+        story: Dict,
+        metadata: Dict,
+        pending_shares: List[str]
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Get the story media into storage
+        
+        Videos are streamed straight from TikTok into Google Drive when
+        possible; otherwise the media is downloaded locally and then uploaded.
+        
+        Returns:
+            (stored, storage_url) - stored is False if the media could not be
+            downloaded at all; storage_url is None if kept locally only
+        """
+        video_url = get_video_url(story)
+        if self._drive_ok and video_url:
+            logger.info(f"Streaming video for @{username} to Google Drive...")
+            try:
+                storage_url = await asyncio.to_thread(
+                    self.drive_uploader.upload_story_from_url,
+                    url=video_url,
+                    username=username,
+                    story_id=post_id,
+                    caption=metadata['caption'],
+                    pending_shares=pending_shares
+                )
+                if storage_url:
+                    return True, storage_url
+            except Exception:
+                 logger.exception("Drive streaming upload failed")
+            logger.info("Streaming not possible, falling back to local download")
+        
         # Download video locally
         logger.info(f"Downloading video for @{username}...")
-        filepath = download_story_media(story, download_dir=DOWNLOAD_DIR)
+        filepath = await asyncio.to_thread(download_story_media, story, download_dir=DOWNLOAD_DIR)
         
         if not filepath:
              logger.error(f"Failed to download video {post_id}")
-             return False
+             return False, None
 
         # Upload to Google Drive
         storage_url = None
-        if self.drive_uploader.is_configured():
+        if self._drive_ok:
             logger.info("Uploading to Google Drive...")
             try:
-                storage_url = self.drive_uploader.upload_story(
+                storage_url = await asyncio.to_thread(
+                    self.drive_uploader.upload_story,
                     file_path=filepath,
                     username=username,
                     story_id=post_id,
-                    caption=metadata['caption']
+                    caption=metadata['caption'],
+                    pending_shares=pending_shares
                 )
-            except Exception as e:
-                 logger.error(f"Drive upload failed: {e}")
+            except Exception:
+                 logger.exception("Drive upload failed")
         else:
             logger.warning("Google Drive not configured, keeping file locally only")
         
-        # Save to state store so we don't download it again next time
-        success = self.state_store.add_post(
-            post_id=post_id,
-            author=username,
-            published_at=metadata['published_at'],
-            url=metadata['url'],
-            caption=metadata['caption'],
-            transcript=metadata.get('transcript'),
-            hashtags=metadata.get('hashtags', []),
-            storage_url=storage_url
-        )
-        
-        if not success:
-            logger.error(f"Failed to add post to state store: {post_id}")
-            return False
-        
-        # Send Slack notification
-        if self.slack_notifier.is_configured():
-            try:
-                slack_success = self.slack_notifier.send_new_video_alert(
-                    author=username,
-                    published_at=metadata['published_at'],
-                    caption=metadata['caption'],
-                    transcript=metadata.get('transcript'),
-                    tiktok_url=metadata['url'],
-                    storage_url=storage_url
-                )
-                if slack_success:
-                    self.state_store.mark_slack_sent(post_id)
-            except Exception as e:
-                 logger.error(f"Slack notification failed: {e}")
+        return True, storage_url
+    
+    def _queue_slack_alert(self, post: Dict):
+        """Queue a Slack notification for a processed post on the background executor"""
+        if not self._slack_ok:
+            return
         
-        logger.info(f"✓ Successfully fully processed post: {post_id}")
-        return True
+        future = self._slack_executor.submit(
+            self.slack_notifier.send_new_video_alert,
+            author=post['author'],
+            published_at=post['published_at'],
+            caption=post['caption'],
+            transcript=post.get('transcript'),
+            tiktok_url=post['url'],
+            storage_url=post.get('storage_url')
+        )
+        future.add_done_callback(lambda f: self._on_slack_alert_done(post['post_id'], f))
+    
+    def _on_slack_alert_done(self, post_id: str, future: Future):
+        """Remember a delivered Slack notification (runs in the worker thread)"""
+        try:
+            if future.result():
+                self._slack_sent_ids.append(str(post_id))
+        except Exception as e:
+             logger.error(f"Slack notification failed: {e}")
     
     def _extract_metadata(self, username: str, story: Dict) -> Dict:
         """Extract metadata from story data"""
@@ -193,17 +376,19 @@ class TikTokMonitor:
         url = story.get('video_url_base', f"https://www.tiktok.com/@{username}/video/{post_id}")
         caption = story.get('desc') or story.get('title') or ''
         
-        transcript = story.get('subtitles')
-        if not transcript and story.get('text_extra'):
-            transcript = ' '.join([t.get('hashtag_name', '') for t in story.get('text_extra', [])])
-            
-        hashtags = [item['hashtag_name'] for item in story.get('text_extra', []) if item.get('hashtag_name')]
+        text_extra = story.get('text_extra') or []
+        hashtags = [item['hashtag_name'] for item in text_extra if item.get('hashtag_name')]
+        
+        # Fall back to the hashtags when there are no subtitles
+        transcript = story.get('subtitles') or (' '.join(hashtags) if hashtags else None)
         
+        # create_time is a unix timestamp (int, float or numeric string); anything
+        # that can't be converted (wrong type, out of range) is kept as-is
         published_at = story.get('create_time')
         if published_at:
             try:
                 published_at = datetime.fromtimestamp(int(published_at)).isoformat()
-            except:
+            except (ValueError, TypeError, OverflowError, OSError):
                 published_at = str(published_at)
         else:
             published_at = datetime.utcnow().isoformat()
@@ -222,7 +407,7 @@ def main():
     """Main entry point"""
     try:
         monitor = TikTokMonitor()
-        new_posts = monitor.run()
+        new_posts = asyncio.run(monitor.run_async())
         
         if new_posts == 0:
             logger.info("No new posts found during this cycle")
@@ -6,18 +6,40 @@ Sends formatted alerts about new TikTok videos to Slack
 
 import os
 import json
+import logging
 from datetime import datetime
 from typing import Optional, Dict, List
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import json_codec
+
+logger = logging.getLogger(__name__)
 
 
 class SlackNotifier:
     """Sends notifications to Slack via webhook or bot token"""
     
+    # Static block shared by all messages (only serialized, never mutated)
+    _DIVIDER = {"type": "divider"}
+    
     def __init__(self, webhook_url: str = None, bot_token: str = None, channel_id: str = None):
         self.webhook_url = webhook_url or os.getenv("SLACK_WEBHOOK_URL")
         self.bot_token = bot_token or os.getenv("SLACK_BOT_TOKEN")
         self.channel_id = channel_id or os.getenv("SLACK_CHANNEL_ID")
+        
+        # One keep-alive session for all notifications (saves a TLS handshake per message)
+        self._session = requests.Session()
+        self._session.headers.update({'Content-Type': 'application/json'})
+        if self.bot_token and not self.webhook_url:
+            self._session.headers.update({'Authorization': f'Bearer {self.bot_token}'})
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=Retry(total=3, backoff_factor=0.3)
+        )
+        self._session.mount('https://', adapter)
     
     def send_new_video_alert(
         self,
@@ -41,7 +63,7 @@ class SlackNotifier:
         elif self.bot_token and self.channel_id:
             return self._send_bot_message(message)
         else:
-            print("Error: No Slack configuration found (webhook or bot token)")
+            logger.error("No Slack configuration found (webhook or bot token)")
             return False
 
     def send_daily_summary(self, posts: List[Dict]) -> bool:
@@ -56,7 +78,7 @@ class SlackNotifier:
             True if message was sent successfully
         """
         if not posts:
-            print("No new posts – skipping daily summary.")
+            logger.info("No new posts – skipping daily summary.")
             return True
 
         # Group posts by author
@@ -77,17 +99,11 @@ class SlackNotifier:
                     "text": f"📋 Daglig TikTok-oppsummering – {today}"
                 }
             },
-            {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": (
-                        f"Siste 24 timer ble det funnet *{total} nye {'story' if total == 1 else 'stories'}* "
-                        f"fra *{num_accounts} {'bruker' if num_accounts == 1 else 'brukere'}*."
-                    )
-                }
-            },
-            {"type": "divider"}
+            self._text_section(
+                f"Siste 24 timer ble det funnet *{total} nye {'story' if total == 1 else 'stories'}* "
+                f"fra *{num_accounts} {'bruker' if num_accounts == 1 else 'brukere'}*."
+            ),
+            self._DIVIDER
         ]
 
         # One section per author
@@ -107,19 +123,13 @@ class SlackNotifier:
             else:
                 link_text = f"<{tiktok_profile}|TikTok-profil> _(ingen Drive-lenke tilgjengelig)_"
 
-            blocks.append({
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": (
-                        f"*@{author}*\n"
-                        f"{count} ny{'' if count == 1 else 'e'} {'story' if count == 1 else 'stories'}\n"
-                        f"{link_text}"
-                    )
-                }
-            })
+            blocks.append(self._text_section(
+                f"*@{author}*\n"
+                f"{count} ny{'' if count == 1 else 'e'} {'story' if count == 1 else 'stories'}\n"
+                f"{link_text}"
+            ))
 
-        blocks.append({"type": "divider"})
+        blocks.append(self._DIVIDER)
         blocks.append({
             "type": "context",
             "elements": [
@@ -140,7 +150,7 @@ class SlackNotifier:
         elif self.bot_token and self.channel_id:
             return self._send_bot_message(message)
         else:
-            print("Error: No Slack configuration found (webhook or bot token)")
+            logger.error("No Slack configuration found (webhook or bot token)")
             return False
 
     def _format_message(
@@ -158,6 +168,12 @@ class SlackNotifier:
             if len(transcript) > 500:
                 transcript_text += "..."
         
+        url_text = f"*TikTok:* <{tiktok_url}|View on TikTok>\n"
+        if storage_url:
+            url_text += f"*Internal video:* <{storage_url}|View on Google Drive>"
+        else:
+            url_text += "*Internal video:* Video download not permitted; sharing TikTok link instead."
+
         blocks = [
             {
                 "type": "header",
@@ -176,82 +192,49 @@ class SlackNotifier:
                 ]
             }
         ]
-        
         if caption:
-            blocks.append({
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"*Caption:*\n{caption}"
-                }
-            })
-
-        blocks.append({
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": f"*Transcript:*\n{transcript_text}"
-            }
-        })
-
-        url_text = f"*TikTok:* <{tiktok_url}|View on TikTok>\n"
-        if storage_url:
-            url_text += f"*Internal video:* <{storage_url}|View on Google Drive>"
-        else:
-            url_text += "*Internal video:* Video download not permitted; sharing TikTok link instead."
-
-        blocks.append({
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": url_text
-            }
-        })
-        blocks.append({"type": "divider"})
+            blocks.append(self._text_section(f"*Caption:*\n{caption}"))
+        blocks.append(self._text_section(f"*Transcript:*\n{transcript_text}"))
+        blocks.append(self._text_section(url_text))
+        blocks.append(self._DIVIDER)
 
         return {
             "blocks": blocks,
             "text": f"New TikTok video from @{author}"
         }
 
+    @staticmethod
+    def _text_section(text: str) -> Dict:
+        """Build a mrkdwn section block"""
+        return {"type": "section", "text": {"type": "mrkdwn", "text": text}}
+
     def _send_webhook(self, message: Dict) -> bool:
         try:
-            response = requests.post(
-                self.webhook_url,
-                json=message,
-                headers={'Content-Type': 'application/json'}
-            )
+            response = self._session.post(self.webhook_url, data=json_codec.dumps(message), timeout=10)
             if response.status_code == 200:
-                print("✓ Slack notification sent via webhook")
+                logger.info("✓ Slack notification sent via webhook")
                 return True
             else:
-                print(f"✗ Slack webhook failed: {response.status_code} - {response.text}")
+                logger.error(f"✗ Slack webhook failed: {response.status_code} - {response.text}")
                 return False
         except Exception as e:
-            print(f"✗ Error sending Slack webhook: {e}")
+            logger.error(f"✗ Error sending Slack webhook: {e}")
             return False
     
     def _send_bot_message(self, message: Dict) -> bool:
         try:
             url = "https://slack.com/api/chat.postMessage"
             payload = {"channel": self.channel_id, **message}
-            response = requests.post(
-                url,
-                json=payload,
-                headers={
-                    'Content-Type': 'application/json',
-                    'Authorization': f'Bearer {self.bot_token}'
-                }
-            )
+            response = self._session.post(url, data=json_codec.dumps(payload), timeout=10)
             result = response.json()
             if result.get('ok'):
-                print("✓ Slack notification sent via bot")
+                logger.info("✓ Slack notification sent via bot")
                 return True
             else:
-                print(f"✗ Slack bot failed: {result.get('error')}")
+                logger.error(f"✗ Slack bot failed: {result.get('error')}")
                 return False
         except Exception as e:
-            print(f"✗ Error sending Slack message: {e}")
+            logger.error(f"✗ Error sending Slack message: {e}")
             return False
     
     def is_configured(self) -> bool:
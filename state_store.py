@@ -5,57 +5,264 @@ Tracks processed posts to ensure idempotency
 """
 
 import sqlite3
-import json
+import json_codec
+import threading
+import queue
+import time
+import atexit
+import logging
 from datetime import datetime
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Set, Iterable
 import os
 
+logger = logging.getLogger(__name__)
+
+# Existing posts are skipped by the primary key instead of a separate lookup
+INSERT_POST_SQL = """
+    INSERT OR IGNORE INTO processed_posts (
+        post_id, author, published_at, url, caption,
+        transcript, hashtags, storage_url, processed_at, slack_sent
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Stay well below SQLite's bound-parameter limit (999 on older builds)
+MAX_SQL_PARAMS = 500
+
+# Stored in PRAGMA user_version once the schema has been created
+SCHEMA_VERSION = 1
+
+# Columns returned by the read methods, in SELECT order
+POST_COLUMNS = (
+    'post_id', 'author', 'published_at', 'url', 'caption',
+    'transcript', 'hashtags', 'storage_url', 'processed_at', 'slack_sent'
+)
+HASHTAGS_INDEX = POST_COLUMNS.index('hashtags')
+SELECT_POSTS_SQL = f"SELECT {', '.join(POST_COLUMNS)} FROM processed_posts"
+
+# Query strings are built once so sqlite3's statement cache always gets a hit
+SELECT_POST_IDS_SQL = "SELECT post_id FROM processed_posts"
+GET_POST_SQL = f"{SELECT_POSTS_SQL} WHERE post_id = ?"
+RECENT_POSTS_SQL = f"{SELECT_POSTS_SQL} ORDER BY published_at DESC LIMIT ?"
+RECENT_POSTS_BY_AUTHOR_SQL = f"{SELECT_POSTS_SQL} WHERE author = ? ORDER BY published_at DESC LIMIT ?"
+POSTS_SINCE_SQL = f"{SELECT_POSTS_SQL} WHERE processed_at >= ? ORDER BY author ASC, processed_at DESC"
+POSTS_SINCE_BY_AUTHOR_SQL = (
+    f"{SELECT_POSTS_SQL} WHERE processed_at >= ? AND author = ? ORDER BY author ASC, processed_at DESC"
+)
+MARK_SLACK_SENT_SQL = "UPDATE processed_posts SET slack_sent = 1 WHERE post_id IN ({placeholders})"
+
+# The background writer commits queued posts once this many are waiting,
+# or after WRITER_MAX_WAIT seconds, whichever comes first
+WRITER_BATCH_SIZE = 128
+WRITER_MAX_WAIT = 0.1
+
+# Queued by close() to make the writer thread exit once everything before it is written
+_STOP_WRITER = object()
+
 
 class StateStore:
     """SQLite-based state store for tracking processed TikTok posts"""
     
     def __init__(self, db_path: str = "tiktok_state.db"):
         self.db_path = db_path
+        
+        # One long-lived connection shared by all threads (serialized by _lock)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        
         self._init_db()
-    
-    def _init_db(self):
-        """Initialize the database schema"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
         
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS processed_posts (
-                post_id TEXT PRIMARY KEY,
-                author TEXT NOT NULL,
-                published_at TEXT NOT NULL,
-                url TEXT NOT NULL,
-                caption TEXT,
-                transcript TEXT,
-                hashtags TEXT,
-                storage_url TEXT,
-                processed_at TEXT NOT NULL,
-                slack_sent BOOLEAN DEFAULT 0
-            )
-        """)
+        # IDs of all processed posts, so lookups never have to touch SQLite
+        with self._lock:
+            self._seen: Set[str] = {
+                row[0] for row in self._get_conn().execute(SELECT_POST_IDS_SQL)
+            }
+        self._seen_lock = threading.Lock()
         
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_author_published 
-            ON processed_posts(author, published_at DESC)
-        """)
+        # Posts whose background write failed since the last flush() (guarded by _seen_lock)
+        self._failed_writes = 0
         
-        conn.commit()
-        conn.close()
+        # add_post() only queues the row; a single writer thread, started on
+        # the first add_post() and stopped by close(), commits in batches
+        self._queue: queue.Queue = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
     
-    def is_processed(self, post_id: str) -> bool:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT 1 FROM processed_posts WHERE post_id = ? LIMIT 1",
-            (post_id,)
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with the per-connection PRAGMAs applied"""
+        # Autocommit mode: every statement commits on its own
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256
         )
-        result = cursor.fetchone()
-        conn.close()
-        return result is not None
+        # WAL makes a commit durable without an fsync of the main database,
+        # so NORMAL is safe; readers no longer block on writers
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA busy_timeout=5000")
+        # Keep dirty pages in memory until commit instead of spilling mid-transaction
+        conn.execute("PRAGMA cache_spill=OFF")
+        return conn
+    
+    def _get_conn(self) -> sqlite3.Connection:
+        """Shared connection, opened on first use"""
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+            return self._conn
+    
+    def _enqueue(self, row: tuple):
+        """Queue a row for the writer thread, starting the thread if needed"""
+        # Held while queuing so close() can't slip its stop marker in between
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._writer_loop, name="state-writer", daemon=True)
+                self._writer.start()
+                # The writer is a daemon thread, so make sure queued posts reach disk
+                atexit.register(self.close)
+            self._queue.put(row)
+    
+    def _stop_writer(self):
+        """Let the writer thread finish the queued rows and exit"""
+        with self._writer_lock:
+            if self._writer is None:
+                return
+            self._queue.put(_STOP_WRITER)
+            self._writer.join()
+            self._writer = None
+            atexit.unregister(self.close)
+    
+    def _writer_loop(self):
+        """Background thread: commit queued rows in batches until _STOP_WRITER"""
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP_WRITER:
+                self._queue.task_done()
+                return
+            
+            batch = [item]
+            deadline = time.monotonic() + WRITER_MAX_WAIT
+            while len(batch) < WRITER_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP_WRITER:
+                    # Write what was collected, then exit
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            # Any error must leave the thread running, or flush() would block forever
+            try:
+                self._insert_rows(batch)
+            except Exception:
+                logger.exception(f"Failed to save {len(batch)} posts to the state store")
+                # Not on disk, so they must not count as processed
+                with self._seen_lock:
+                    self._seen.difference_update(row[0] for row in batch)
+                    self._failed_writes += len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    def flush(self) -> bool:
+        """
+        Block until every queued post has been written
+        
+        Returns:
+            False if posts failed to save since the last flush by any caller
+            (they are logged and no longer reported by is_processed()), else
+            True; check is_processed() to know whether a given post was saved
+        """
+        self._queue.join()
+        with self._seen_lock:
+            failed, self._failed_writes = self._failed_writes, 0
+        if failed:
+            logger.error(f"{failed} posts could not be saved to the state store")
+        return failed == 0
+    
+    def close(self):
+        """
+        Write pending posts, stop the writer thread and close the shared
+        connection (both are started again if the store is used again)
+        
+        Returns:
+            Result of flush(): False if queued posts failed to save
+        """
+        self._stop_writer()
+        saved = self.flush()
+        with self._lock:
+            if self._conn is not None:
+                # Refresh query planner statistics where SQLite thinks it pays off
+                self._conn.execute("PRAGMA optimize")
+                # Move committed rows from the -wal file into the database file,
+                # so copying just the .db file (e.g. the CI cache) captures them
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                self._conn.close()
+                self._conn = None
+        return saved
+    
+    def _init_db(self):
+        """Initialize the database schema"""
+        with self._lock:
+            cursor = self._get_conn().cursor()
+            
+            # Schema is already in place - skip the DDL round trips
+            cursor.execute("PRAGMA user_version")
+            if cursor.fetchone()[0] >= SCHEMA_VERSION:
+                return
+            
+            # journal_mode is stored in the database file, so setting it once is enough
+            cursor.execute("PRAGMA journal_mode=WAL")
+            
+            # Keyed directly on post_id: a primary key lookup is a single b-tree probe
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS processed_posts (
+                    post_id TEXT PRIMARY KEY,
+                    author TEXT NOT NULL,
+                    published_at TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    caption TEXT,
+                    transcript TEXT,
+                    hashtags TEXT,
+                    storage_url TEXT,
+                    processed_at TEXT NOT NULL,
+                    slack_sent BOOLEAN DEFAULT 0
+                ) WITHOUT ROWID
+            """)
+            
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_author_published 
+                ON processed_posts(author, published_at DESC)
+            """)
+            
+            # Bump SCHEMA_VERSION (and add a migration step above) on schema changes
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    
+    def is_processed(self, post_id: str) -> bool:
+        return post_id in self._seen
+    
+    def filter_unprocessed(self, post_ids: List[str]) -> Set[str]:
+        """
+        Find which of the given posts have not been processed yet
+
+        Args:
+            post_ids: Candidate post IDs (duplicates are fine)
+
+        Returns:
+            Set of post IDs that are not in the state store
+        """
+        with self._seen_lock:
+            return set(post_ids) - self._seen
     
     def add_post(
         self,
@@ -66,93 +273,149 @@ class StateStore:
         caption: Optional[str] = None,
         transcript: Optional[str] = None,
         hashtags: Optional[List[str]] = None,
-        storage_url: Optional[str] = None
+        storage_url: Optional[str] = None,
+        slack_sent: bool = False
     ) -> bool:
-        if self.is_processed(post_id):
-            return False
+        """
+        Record a processed post
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        The row is written by the background writer thread, so this returns
+        immediately; call flush() when the post must be on disk. If the write
+        fails, the post stops counting as processed and flush() returns False.
         
-        try:
-            cursor.execute("""
-                INSERT INTO processed_posts (
-                    post_id, author, published_at, url, caption,
-                    transcript, hashtags, storage_url, processed_at, slack_sent
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
-            """, (
-                post_id,
-                author,
-                published_at,
-                url,
-                caption,
-                transcript,
-                json.dumps(hashtags) if hashtags else None,
-                storage_url,
-                datetime.utcnow().isoformat()
-            ))
-            conn.commit()
-            conn.close()
-            return True
-        except sqlite3.IntegrityError:
-            conn.close()
-            return False
+        Returns:
+            True if the post was new, False if it was already processed
+        """
+        # Serialize here so bad input fails the caller, not the writer thread
+        row = self._post_row({
+            'post_id': post_id,
+            'author': author,
+            'published_at': published_at,
+            'url': url,
+            'caption': caption,
+            'transcript': transcript,
+            'hashtags': hashtags,
+            'storage_url': storage_url,
+            'slack_sent': slack_sent
+        }, datetime.utcnow().isoformat())
+        
+        with self._seen_lock:
+            if post_id in self._seen:
+                return False
+            self._seen.add(post_id)
+        
+        self._enqueue(row)
+        return True
     
-    def mark_slack_sent(self, post_id: str) -> bool:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE processed_posts SET slack_sent = 1 WHERE post_id = ?",
-            (post_id,)
+    def add_posts(self, posts: Iterable[Dict]) -> int:
+        """
+        Insert several posts in one transaction (one commit instead of one per post)
+        
+        Args:
+            posts: Post dicts with the add_post() fields as keys
+                (post_id, author, published_at, url and optionally caption,
+                transcript, hashtags, storage_url, slack_sent)
+            
+        Returns:
+            Number of posts that were new; already processed posts are skipped
+        """
+        # One timestamp for the whole batch (kept as ISO text so get_posts_since() still compares)
+        processed_at = datetime.utcnow().isoformat()
+        return self._insert_rows([self._post_row(post, processed_at) for post in posts])
+    
+    @staticmethod
+    def _post_row(post: Dict, processed_at: str) -> tuple:
+        """Build the INSERT_POST_SQL parameters for a post dict"""
+        return (
+            post['post_id'],
+            post['author'],
+            post['published_at'],
+            post['url'],
+            post.get('caption'),
+            post.get('transcript'),
+            json_codec.dumps(post['hashtags']).decode('utf-8') if post.get('hashtags') else None,
+            post.get('storage_url'),
+            processed_at,
+            1 if post.get('slack_sent') else 0
         )
-        updated = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
+    
+    def _insert_rows(self, rows: List[tuple]) -> int:
+        """Insert prepared rows in one transaction; returns the number of new posts"""
+        if not rows:
+            return 0
+        
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = conn.executemany(INSERT_POST_SQL, rows)
+                conn.execute("COMMIT")
+            except Exception:
+                # A failed COMMIT may already have ended the transaction
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+        with self._seen_lock:
+            self._seen.update(row[0] for row in rows)
+        # rowcount only counts rows that were actually inserted
+        return cursor.rowcount
+    
+    def mark_slack_sent(self, post_id: str) -> bool:
+        return self.mark_slack_sent_many([post_id]) > 0
+    
+    def mark_slack_sent_many(self, post_ids: List[str]) -> int:
+        """
+        Flag several posts as announced in Slack in one transaction
+        
+        Args:
+            post_ids: IDs of posts whose Slack notification was delivered
+            
+        Returns:
+            Number of posts that were updated
+        """
+        unique_ids = list(dict.fromkeys(post_ids))
+        if not unique_ids:
+            return 0
+        
+        self.flush()
+        updated = 0
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for start in range(0, len(unique_ids), MAX_SQL_PARAMS):
+                    chunk = unique_ids[start:start + MAX_SQL_PARAMS]
+                    placeholders = ','.join('?' * len(chunk))
+                    cursor = conn.execute(MARK_SLACK_SENT_SQL.format(placeholders=placeholders), chunk)
+                    updated += cursor.rowcount
+                conn.execute("COMMIT")
+            except Exception:
+                # A failed COMMIT may already have ended the transaction
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
         return updated
     
     def get_post(self, post_id: str) -> Optional[Dict]:
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM processed_posts WHERE post_id = ?",
-            (post_id,)
-        )
-        row = cursor.fetchone()
-        conn.close()
+        self.flush()
+        with self._lock:
+            cursor = self._get_conn().cursor()
+            cursor.execute(GET_POST_SQL, (post_id,))
+            row = cursor.fetchone()
         if row:
-            post = dict(row)
-            if post.get('hashtags'):
-                post['hashtags'] = json.loads(post['hashtags'])
-            return post
+            return self._rows_to_posts([row])[0]
         return None
     
     def get_recent_posts(self, author: Optional[str] = None, limit: int = 100) -> List[Dict]:
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        if author:
-            cursor.execute("""
-                SELECT * FROM processed_posts 
-                WHERE author = ?
-                ORDER BY published_at DESC 
-                LIMIT ?
-            """, (author, limit))
-        else:
-            cursor.execute("""
-                SELECT * FROM processed_posts 
-                ORDER BY published_at DESC 
-                LIMIT ?
-            """, (limit,))
-        rows = cursor.fetchall()
-        conn.close()
-        posts = []
-        for row in rows:
-            post = dict(row)
-            if post.get('hashtags'):
-                post['hashtags'] = json.loads(post['hashtags'])
-            posts.append(post)
-        return posts
+        self.flush()
+        with self._lock:
+            cursor = self._get_conn().cursor()
+            if author:
+                cursor.execute(RECENT_POSTS_BY_AUTHOR_SQL, (author, limit))
+            else:
+                cursor.execute(RECENT_POSTS_SQL, (limit,))
+            rows = cursor.fetchall()
+        return self._rows_to_posts(rows)
 
     def get_posts_since(self, since: datetime, author: Optional[str] = None) -> List[Dict]:
         """
@@ -166,33 +429,26 @@ class StateStore:
         Returns:
             List of post dicts ordered by author, then processed_at
         """
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
         since_str = since.isoformat()
 
-        if author:
-            cursor.execute("""
-                SELECT * FROM processed_posts
-                WHERE processed_at >= ? AND author = ?
-                ORDER BY author ASC, processed_at DESC
-            """, (since_str, author))
-        else:
-            cursor.execute("""
-                SELECT * FROM processed_posts
-                WHERE processed_at >= ?
-                ORDER BY author ASC, processed_at DESC
-            """, (since_str,))
-
-        rows = cursor.fetchall()
-        conn.close()
-
-        posts = []
-        for row in rows:
-            post = dict(row)
-            if post.get('hashtags'):
-                post['hashtags'] = json.loads(post['hashtags'])
-            posts.append(post)
-
-        return posts
+        self.flush()
+        with self._lock:
+            cursor = self._get_conn().cursor()
+            if author:
+                cursor.execute(POSTS_SINCE_BY_AUTHOR_SQL, (since_str, author))
+            else:
+                cursor.execute(POSTS_SINCE_SQL, (since_str,))
+            rows = cursor.fetchall()
+
+        return self._rows_to_posts(rows)
+    
+    @staticmethod
+    def _rows_to_posts(rows: List[tuple]) -> List[Dict]:
+        """Build post dicts from rows selected with SELECT_POSTS_SQL"""
+        return [
+            dict(
+                zip(POST_COLUMNS, row),
+                hashtags=json_codec.loads(row[HASHTAGS_INDEX]) if row[HASHTAGS_INDEX] else None
+            )
+            for row in rows
+        ]
@@ -5,9 +5,15 @@ Downloads TikTok user stories via the Apify TikTok Story Viewer actor (BATCH OPT
 """
 
 import os
+import re
+import shutil
+import asyncio
 import requests
 import json
-from apify_client import ApifyClient
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from apify_client import ApifyClient, ApifyClientAsync
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -16,36 +22,134 @@ load_dotenv()
 # Configuration
 APIFY_API_TOKEN = os.getenv("APIFY_API_TOKEN")
 DOWNLOAD_DIR = "stories"
+APIFY_ACTOR_ID = "igview-owner/tiktok-story-viewer"
 
-def fetch_tiktok_stories_batch(usernames, apify_token=APIFY_API_TOKEN):
+# Users per Apify run (0 = all users in one run, cheapest).
+# Smaller batches are fetched as concurrent runs - faster, but every run costs.
+APIFY_BATCH_SIZE = int(os.getenv("APIFY_BATCH_SIZE", "0"))
+MAX_CONCURRENT_APIFY_RUNS = 10
+
+# Parallel downloads in process_all_users (fits in the session connection pool)
+MAX_DOWNLOAD_WORKERS = 8
+
+# File extension for the Content-Type a download is served with
+MEDIA_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/webp': '.webp',
+    'image/png': '.png',
+    'video/mp4': '.mp4',
+}
+
+# Fallback when the Content-Type is missing or generic: extension in the URL path
+URL_EXTENSIONS = {
+    '.jpg': '.jpg',
+    '.jpeg': '.jpg',
+    '.webp': '.webp',
+    '.png': '.png',
+    '.mp4': '.mp4',
+}
+_URL_EXTENSION_RE = re.compile(r'\.(jpe?g|webp|png|mp4)$', re.IGNORECASE)
+
+# Copy/write buffer for downloads (one write syscall per MiB)
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Directories already created by _ensure_dir
+_CREATED_DIRS = set()
+
+# Shared session so downloads from the same CDN host reuse keep-alive connections
+_SESSION = requests.Session()
+
+def configure_download_pool(pool_size):
     """
-    Fetch TikTok stories for MULTIPLE usernames using Apify in a single run
+    Size the shared download session's connection pool. Use the number of
+    threads downloading at once - a full pool discards the extra connections.
+    """
+    _SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=pool_size, max_retries=3))
+
+configure_download_pool(MAX_DOWNLOAD_WORKERS)
+
+def get_download_session():
+    """Shared pooled session for downloading TikTok media (also used for streamed uploads)"""
+    return _SESSION
+
+def iter_tiktok_stories_batch(usernames, apify_token=APIFY_API_TOKEN):
+    """
+    Fetch TikTok stories for MULTIPLE usernames using Apify in a single run,
+    yielding each story as soon as its dataset page has been read
     """
     client = ApifyClient(apify_token)
     run_input = {"uniqueIds": usernames}
     
     print(f"Fetching stories for {len(usernames)} users simultaneously...")
-    run = client.actor("igview-owner/tiktok-story-viewer").call(run_input=run_input)
+    run = client.actor(APIFY_ACTOR_ID).call(run_input=run_input)
+
+    yield from client.dataset(run["defaultDatasetId"]).iterate_items()
+
+def fetch_tiktok_stories_batch(usernames, apify_token=APIFY_API_TOKEN):
+    """
+    Fetch TikTok stories for MULTIPLE usernames using Apify in a single run
+    """
+    stories = list(iter_tiktok_stories_batch(usernames, apify_token))
+
+    print(f"Found {len(stories)} stories in total")
+    return stories
 
-    stories = []
-    for item in client.dataset(run["defaultDatasetId"]).iterate_items():
-        stories.append(item)
+async def fetch_tiktok_stories_batch_async(usernames, apify_token=APIFY_API_TOKEN, batch_size=APIFY_BATCH_SIZE):
+    """
+    Fetch TikTok stories for MULTIPLE usernames without blocking the event loop.
+    Users are split into batches of batch_size (0 = one run for everyone) and
+    the Apify runs are executed concurrently.
+    """
+    client = ApifyClientAsync(apify_token)
+    if batch_size and batch_size > 0:
+        batches = [usernames[i:i + batch_size] for i in range(0, len(usernames), batch_size)]
+    else:
+        batches = [usernames]
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_APIFY_RUNS)
+
+    async def fetch_batch(batch):
+        async with semaphore:
+            run = await client.actor(APIFY_ACTOR_ID).call(run_input={"uniqueIds": batch})
+            return [item async for item in client.dataset(run["defaultDatasetId"]).iterate_items()]
 
+    print(f"Fetching stories for {len(usernames)} users in {len(batches)} Apify run(s)...")
+    results = await asyncio.gather(*[fetch_batch(batch) for batch in batches])
+
+    stories = [story for batch_stories in results for story in batch_stories]
     print(f"Found {len(stories)} stories in total")
     return stories
 
+def get_video_url(story_data):
+    """
+    Return the direct video URL of a story, or None for photo/image stories.
+    Used to stream videos straight to storage without a local copy.
+    """
+    if story_data.get('images') or story_data.get('image_url'):
+        return None
+    # duration == 0 betyr bilde, ikke video
+    if story_data.get('duration', None) == 0:
+        return None
+    return story_data.get('video_url') or story_data.get('download_url') or story_data.get('playAddr')
+
+def _ensure_dir(path):
+    """
+    os.makedirs(path, exist_ok=True), but only the first time a path is seen in this process
+    """
+    if path not in _CREATED_DIRS:
+        os.makedirs(path, exist_ok=True)
+        _CREATED_DIRS.add(path)
+
 def download_story_media(story_data, download_dir=DOWNLOAD_DIR):
     """
     Download media safely by reading the file's Content-Type headers directly from the internet.
     Handles both video stories and image-only stories (duration == 0).
     """
-    os.makedirs(download_dir, exist_ok=True)
-
     username = story_data.get('unique_id', 'unknown')
     story_id = str(story_data.get('aweme_id') or story_data.get('video_id', 'unknown'))
 
+    # makedirs creates download_dir too
     user_dir = os.path.join(download_dir, username)
-    os.makedirs(user_dir, exist_ok=True)
+    _ensure_dir(user_dir)
 
     media_url = None
     is_photo = False
@@ -84,64 +188,71 @@ def download_story_media(story_data, download_dir=DOWNLOAD_DIR):
 
     try:
         # Bank på døren til filen og be om 'ID-kortet' før vi laster den ned (stream=True)
-        response = requests.get(media_url, stream=True, timeout=30)
-        response.raise_for_status()
-
-        # Den magiske sjekken: Hva ER egentlig denne filen?
-        content_type = response.headers.get('Content-Type', '').lower()
-
-        # Hvis internett sier at dette bare er lyd (feilaktig returnert av TikTok)
-        if 'audio' in content_type:
-            # For bilde-stories: prøv cover_url som fallback hvis vi ikke allerede bruker den
-            if not is_photo and story_data.get('cover_url') and media_url != story_data.get('cover_url'):
-                print(f"⚠️ Lydfil oppdaget – prøver cover_url som fallback for {story_id}")
-                story_data_copy = dict(story_data)
-                story_data_copy['duration'] = 0
-                return download_story_media(story_data_copy, download_dir)
-            print(f"⚠️ Avbrutt: Fant bare en lydfil ({content_type}) for {story_id}. Hopper over!")
-            return None
-
-        # Sett riktig filendelse basert på ID-kortet
-        if 'image' in content_type or is_photo or 'webp' in content_type:
-            # Cover-bilder fra TikTok er ofte webp
-            if 'webp' in content_type or (media_url and 'webp' in media_url.lower()):
-                extension = '.webp'
-            else:
-                extension = '.jpg'
-        else:
-            extension = '.mp4'
-
-        filename = f"{story_id}{extension}"
-        filepath = os.path.join(user_dir, filename)
-
-        if os.path.exists(filepath):
-            print(f"File {filename} already exists. Skipping download.")
-            return filepath
+        with _SESSION.get(media_url, stream=True, timeout=(5, 60)) as response:
+            response.raise_for_status()
+
+            # Den magiske sjekken: Hva ER egentlig denne filen?
+            content_type = response.headers.get('Content-Type', '').lower()
+
+            # Hvis internett sier at dette bare er lyd (feilaktig returnert av TikTok)
+            if 'audio' in content_type:
+                # For bilde-stories: prøv cover_url som fallback hvis vi ikke allerede bruker den
+                if not is_photo and story_data.get('cover_url') and media_url != story_data.get('cover_url'):
+                    print(f"⚠️ Lydfil oppdaget – prøver cover_url som fallback for {story_id}")
+                    story_data_copy = dict(story_data)
+                    story_data_copy['duration'] = 0
+                    return download_story_media(story_data_copy, download_dir)
+                print(f"⚠️ Avbrutt: Fant bare en lydfil ({content_type}) for {story_id}. Hopper over!")
+                return None
+
+            # Sett riktig filendelse basert på ID-kortet (cover-bilder fra TikTok er ofte webp)
+            extension = MEDIA_EXTENSIONS.get(content_type.split(';')[0].strip())
+            if extension is None:
+                # Ukjent type: bruk endelsen på slutten av URL-stien (query-strengen ignoreres)
+                match = _URL_EXTENSION_RE.search(urlsplit(media_url).path)
+                extension = URL_EXTENSIONS[f".{match.group(1).lower()}"] if match else None
+            if extension is None:
+                extension = '.jpg' if is_photo or content_type.startswith('image/') else '.mp4'
+
+            filename = f"{story_id}{extension}"
+            filepath = os.path.join(user_dir, filename)
 
-        print(f"Downloading {filename}...")
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+            if os.path.exists(filepath):
+                print(f"File {filename} already exists. Skipping download.")
+                return filepath
+
+            print(f"Downloading {filename}...")
+            # Let urllib3 undo any gzip/deflate encoding, then copy in large blocks
+            response.raw.decode_content = True
+            fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                f = os.fdopen(fd, 'wb', buffering=WRITE_BUFFER_SIZE)
+            except Exception:
+                os.close(fd)
+                raise
+            with f:
+                shutil.copyfileobj(response.raw, f, length=WRITE_BUFFER_SIZE)
         
-        print(f"✓ Saved to {filepath} (Type: {content_type})")
-        return filepath
+            print(f"✓ Saved to {filepath} (Type: {content_type})")
+            return filepath
     
     except Exception as e:
         print(f"✗ Error downloading {story_id}: {e}")
         return None
 
 def process_all_users(usernames, apify_token=APIFY_API_TOKEN, download_dir=DOWNLOAD_DIR):
-    stories = fetch_tiktok_stories_batch(usernames, apify_token)
-    
-    if not stories:
+    stories = iter_tiktok_stories_batch(usernames, apify_token)
+
+    # Downloads are I/O-bound and independent, so run them side by side.
+    # Stories are submitted while the dataset is still being paged through.
+    with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as pool:
+        results = list(pool.map(lambda story: download_story_media(story, download_dir), stories))
+
+    if not results:
         print("No stories found for the provided users.")
         return []
 
-    downloaded_files = []
-    for story in stories:
-        filepath = download_story_media(story, download_dir)
-        if filepath:
-            downloaded_files.append(filepath)
+    downloaded_files = [filepath for filepath in results if filepath]
 
     print(f"\n✓ Finished processing. Handled {len(downloaded_files)} stories.")
     return downloaded_files